@@ -1,104 +1,257 @@
+import os
 import socket
+import selectors
 import threading
 import time
 import argparse
-import random
-import string
+import logging
+import secrets
+import bisect
+import itertools
 
 from collections import deque
-from pprint import pprint
-from dataclasses import dataclass, field, asdict
-
-
-def decode_resp(data, start_index=0) -> tuple[list, int]:
-    data_type = data[start_index]
-    # Determine the end of the current segment based on the data type
-    end_index = data.find("\r\n", start_index)
-    content = data[start_index + 1 : end_index]
-
-    if data_type == "+":  # Simple String
-        return content, end_index + 2
-    elif data_type == "-":  # Error
-        return Exception(content), end_index + 2
-    elif data_type == ":":  # Integer
-        return int(content), end_index + 2
-    elif data_type == "$":  # Bulk String
-        length = int(content)
-        if length == -1:  # Handle Null Bulk String
-            return None, end_index + 2
-        start_of_content = end_index + 2
-        end_of_content = start_of_content + length
-        return data[start_of_content:end_of_content], end_of_content + 2
-    elif data_type == "*":  # Array
-        count = int(content)
-        elements = []
-        current_index = end_index + 2
-        for _ in range(count):
-            element, next_index = decode_resp(data, current_index)
-            elements.append(element)
-            current_index = next_index
-        return elements, current_index
-    else:
-        raise ValueError(f"Unknown RESP data type: {data_type}")
+from dataclasses import dataclass, field, fields
+
+log = logging.getLogger("resp")
+log.setLevel(logging.WARNING)
+
+try:
+    # hiredis parses RESP in C; client connections use it when available and
+    # fall back to the pure-Python decoder below otherwise.
+    import hiredis
+except ImportError:
+    hiredis = None
+
+
+SIMPLE_STRING_BYTE = ord("+")
+ERROR_BYTE = ord("-")
+INTEGER_BYTE = ord(":")
+BULK_STRING_BYTE = ord("$")
+ARRAY_BYTE = ord("*")
+
+
+# Scalar line types decode straight from the line content; bulk strings and
+# arrays are handled inline by the decode loop since they change the cursor.
+_RESP_LINE_DECODERS = {
+    SIMPLE_STRING_BYTE: lambda content: content,
+    ERROR_BYTE: lambda content: Exception(content.decode("utf-8", errors="ignore")),
+    INTEGER_BYTE: int,
+}
+
+
+def _scan_line_breaks(data, start_index=0, end=None) -> list[int]:
+    """One forward pass recording every \\r\\n position in the buffer."""
+    if end is None:
+        end = len(data)
+    positions = []
+    i = data.find(b"\r\n", start_index, end)
+    while i != -1:
+        positions.append(i)
+        i = data.find(b"\r\n", i + 2, end)
+    return positions
+
+
+def _decode_value(
+    data, start_index: int, line_breaks: list[int], end=None
+) -> tuple[object, int]:
+    if end is None:
+        end = len(data)
+    index = start_index
+    cursor = bisect.bisect_left(line_breaks, index)
+    stack = []  # (expected_count, elements) frames for in-progress arrays
+
+    while True:
+        data_type = data[index]  # the RESP type byte, as an int
+        end_index = line_breaks[cursor]  # IndexError means incomplete frame
+        content = bytes(data[index + 1 : end_index])
+
+        if data_type == BULK_STRING_BYTE:
+            length = int(content)
+            if length == -1:  # Handle Null Bulk String
+                value = None
+                index = end_index + 2
+            else:
+                start_of_content = end_index + 2
+                end_of_content = start_of_content + length
+                if end_of_content + 2 > end:
+                    raise ValueError("Incomplete bulk string frame")
+                value = bytes(data[start_of_content:end_of_content])
+                index = end_of_content + 2
+            # Content may itself contain \r\n, so jump the cursor past it
+            cursor = bisect.bisect_left(line_breaks, index, cursor + 1)
+        elif data_type == ARRAY_BYTE:
+            count = int(content)
+            index = end_index + 2
+            cursor += 1
+            if count > 0:
+                stack.append((count, []))
+                continue
+            value = []
+        else:
+            decoder = _RESP_LINE_DECODERS.get(data_type)
+            if decoder is None:
+                raise ValueError(f"Unknown RESP data type: {chr(data_type)}")
+            value = decoder(content)
+            index = end_index + 2
+            cursor += 1
+
+        # Fold the finished value into any enclosing array frames
+        while True:
+            if not stack:
+                return value, index
+            expected_count, elements = stack[-1]
+            elements.append(value)
+            if len(elements) < expected_count:
+                break  # next loop iteration parses the next element
+            stack.pop()
+            value = elements
+
+
+def decode_resp(data, start_index=0) -> tuple[object, int]:
+    return _decode_value(data, start_index, _scan_line_breaks(data, start_index))
+
+
+# Shape-specialized encoders for the handful of reply forms handlers actually
+# produce; binding them directly skips encode_resp's isinstance cascade.
+# Bulk-length headers for short payloads are shared constants so encoding a
+# small value never formats the same "$N\r\n" prefix twice.
+_BULK_HDR = [b"$%d\r\n" % n for n in range(1024)]
+
+
+def encode_bulk(payload: bytes) -> bytes:
+    n = len(payload)
+    hdr = _BULK_HDR[n] if n < 1024 else b"$%d\r\n" % n
+    return b"%s%s\r\n" % (hdr, payload)
+
 
+def encode_simple(payload: bytes) -> bytes:
+    return b"+%s\r\n" % payload
 
-def encode_resp(data: object) -> str:
-    if isinstance(data, str):  # Bulk String
-        return f"${len(data)}\r\n{data}\r\n"
+
+def _encode_into(out: bytearray, data: object) -> None:
+    # Streams every element into the one accumulator the top-level call owns,
+    # so nested arrays never materialize intermediate bytes objects.
+    if isinstance(data, bytes):  # Bulk String
+        n = len(data)
+        out += _BULK_HDR[n] if n < 1024 else b"$%d\r\n" % n
+        out += data
+        out += b"\r\n"
+    elif isinstance(data, str):  # Bulk String from str
+        _encode_into(out, data.encode("utf-8"))
     elif isinstance(data, Exception):  # Error
-        return f"-{str(data)}\r\n"
+        out += b"-%s\r\n" % str(data).encode("utf-8")
     elif isinstance(data, int):  # Integer
-        return f":{data}\r\n"
+        out += b":%d\r\n" % data
     elif data is None:  # Null Bulk String
-        return "$-1\r\n"
-    elif isinstance(data, bytes):  # Bulk String from bytes
-        return f"${len(data)}\r\n{data.decode('utf-8', errors='ignore')}"
+        out += b"$-1\r\n"
     elif isinstance(data, list):  # Array
-        encoded_elements = "".join([encode_resp(element) for element in data])
-        return f"*{len(data)}\r\n{encoded_elements}"
+        out += b"*%d\r\n" % len(data)
+        for element in data:
+            _encode_into(out, element)
     else:
         raise TypeError(f"Unsupported data type: {type(data)}")
 
 
-def decode_multiple_resp_commands(data: str) -> list[list[tuple[str, int]]]:
+def encode_resp(data: object) -> bytes:
+    out = bytearray()
+    _encode_into(out, data)
+    return bytes(out)
+
+
+def _decode_command_fast(data: bytes, index: int, end: int):
+    """
+    Specialized decoder for the shape every client command has: a flat array
+    of bulk strings. Returns (values, next_index), or None when the frame is
+    some other RESP shape and the generic decoder must take over. Raises
+    ValueError when the frame is incomplete, like the generic decoder.
+    """
+    if data[index] != ARRAY_BYTE:
+        return None
+    header_end = data.index(b"\r\n", index + 1, end)
+    count = int(data[index + 1 : header_end])
+    if count < 0:
+        return None
+    cursor = header_end + 2
+    values = []
+    for _ in range(count):
+        if cursor >= end or data[cursor] != BULK_STRING_BYTE:
+            return None
+        length_end = data.index(b"\r\n", cursor + 1, end)
+        length = int(data[cursor + 1 : length_end])
+        if length < 0:
+            return None
+        content_start = length_end + 2
+        content_end = content_start + length
+        if content_end + 2 > end:
+            raise ValueError("Incomplete bulk string frame")
+        values.append(bytes(data[content_start:content_end]))
+        cursor = content_end + 2
+    return values, cursor
+
+
+def decode_multiple_resp_commands(data: bytes, end=None) -> list[tuple[object, int]]:
+    if end is None:
+        end = len(data)
+    line_breaks = None  # only scanned if a frame falls off the fast path
     index = 0
     result = []
-    while index < len(data):
+    while index < end:
         try:
-            curr, next_index = decode_resp(data, start_index=index)
+            decoded = _decode_command_fast(data, index, end)
+            if decoded is None:
+                if line_breaks is None:
+                    line_breaks = _scan_line_breaks(data, 0, end)
+                decoded = _decode_value(data, index, line_breaks, end)
+            curr, next_index = decoded
         except:
             break
-        result.append((curr, len(data[index:next_index].encode("utf-8"))))
+        result.append((curr, next_index - index))
         index = next_index
     return result
 
 
-def unix_timestamp() -> int:
-    return int(time.time_ns() // 1_000_000)  # miliseconds
+def warm_up_parser() -> None:
+    """
+    Runs the decode/encode path on a representative frame before the first
+    client connects, so adaptive-interpreter specialization (and lazy imports
+    inside the codecs machinery) happen outside the request path.
+    """
+    sample = bytearray(b"*3\r\n$3\r\nSET\r\n$3\r\nfoo\r\n$3\r\nbar\r\n*1\r\n$4\r\nPING\r\n")
+    for _ in range(100):
+        for command, _size in decode_multiple_resp_commands(sample):
+            encode_resp(command)
+
+
+def monotonic_ms() -> int:
+    return time.monotonic_ns() // 1_000_000  # miliseconds
 
 
 def serialize_dataclass(instance) -> list[str]:
-    data_dict = asdict(instance)
     return [
-        f"{key}:{value}" for key, value in data_dict.items() if not key.startswith("__")
+        f"{f.name}:{getattr(instance, f.name)}"
+        for f in fields(instance)
+        if not f.name.startswith("_")
     ]
 
 
 def random_str(n: int = 40) -> str:
-    characters = string.ascii_letters + string.digits
-    random_str = "".join(random.choice(characters) for _ in range(n))
-    return random_str
+    return secrets.token_hex(n // 2)
+
 
+# Constant replies, bound once; PONG and OK are simple strings as in real
+# Redis rather than re-encoded bulk strings per request.
+PONG_REPLY = b"+PONG\r\n"
+OK_REPLY = b"+OK\r\n"
+NULL_REPLY = b"$-1\r\n"
 
 EMPTY_RDB: str = (
     "524544495330303131fa0972656469732d76657205372e322e30fa0a72656469732d62697473c040fa056374696d65c26d08bc65fa08757365642d6d656dc2b0c41000fa08616f662d62617365c000fff06e3bfec0ff5aa2"
 )
-MAX_32BIT_TIMESTAMP = (2**31 - 1) * 1_000
 MASTER_REPLICATION: str = "master"
 SLAVE_REPLICATION: str = "slave"
 
 
-@dataclass
+@dataclass(slots=True)
 class ReplicationInfo:
     role: str = MASTER_REPLICATION
     # connected_slaves: int
@@ -111,283 +264,593 @@ class ReplicationInfo:
     # repl_backlog_histlen: int = 0
 
 
-@dataclass
-class Replica:
+RECV_BUFFER_SIZE = 65536
+# Freelist of idle receive buffers, so connection churn reuses buffers
+# instead of allocating and collecting 64 KiB per accept
+_buffer_pool: deque = deque(maxlen=1024)
+
+
+def acquire_read_buffer() -> bytearray:
+    return _buffer_pool.popleft() if _buffer_pool else bytearray(RECV_BUFFER_SIZE)
+
+
+def release_read_buffer(buffer: bytearray) -> None:
+    # Buffers grown for an oversize frame are dropped to keep the pool bounded
+    if len(buffer) == RECV_BUFFER_SIZE:
+        _buffer_pool.append(buffer)
+
+
+@dataclass(slots=True)
+class Connection:
+    """Per-socket state tracked by the event loop."""
+
     socket: socket.socket
+    address: object
+    read_buffer: bytearray = field(default_factory=acquire_read_buffer)
+    tail: int = 0  # number of unparsed bytes at the front of read_buffer
+    write_queue: deque = field(default_factory=deque)
+    is_replica: bool = False
+    is_master_link: bool = False
+    # hiredis.Reader doing the buffering and parsing for this connection, or
+    # None when the pure-Python decoder is used
+    resp_reader: object = None
+    # Replica bookkeeping (master side): bytes we sent vs bytes it acked.
     expected_offset: int = 0
+    # Replica side: bytes of the replication stream processed so far.
     last_offset: int = 0
+    processed_offset: int = 0
+    # Set by close_connection; guards against double teardown when a flush
+    # fails while the connection is still referenced elsewhere in the tick.
+    closed: bool = False
+
 
-    def send(self, data: bytes):
-        self.socket.sendall(data)
-        self.expected_offset += len(data)
+@dataclass(slots=True)
+class PendingWait:
+    """A WAIT command whose reply is deferred until replicas ack or timeout."""
 
+    connection: Connection
+    min_replicas: int
+    deadline: int
+    target_offset: int
 
-@dataclass
-class ValueItem:
-    value: object
-    expiry_timestamp: int = field(init=True, default=MAX_32BIT_TIMESTAMP)
 
+@dataclass(slots=True)
+class Shard:
+    """
+    One stripe of the keyspace. Values and expiries live in separate dicts so
+    the GET fast path for keys without a TTL never touches expiry data; only
+    keys SET with PX ever appear in expiries.
+    """
 
-not_found = ValueItem(None, None)
-database_lock = threading.Lock()
-replica_sockets_lock = threading.Lock()
-database: dict[str, ValueItem] = dict()
-replica_sockets: list[Replica] = []
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    values: dict[bytes, bytes] = field(default_factory=dict)
+    expiries: dict[bytes, int] = field(default_factory=dict)
+    # Encoded bulk replies, filled lazily on first GET and dropped whenever
+    # the key is overwritten or evicted; repeated GETs of a hot key return
+    # the same bytes object without re-framing it.
+    encoded: dict[bytes, bytes] = field(default_factory=dict)
+
+
+selector = selectors.DefaultSelector()
+# Single process-wide replication state; the role is set at startup
+replication_info = ReplicationInfo()
+# The keyspace is striped over independently locked shards so commands and any
+# background maintenance only ever contend on the shard they actually touch.
+SHARDS = 32  # power of two, so the mask below replaces a modulo
+shards: list[Shard] = [Shard() for _ in range(SHARDS)]
+replica_connections: list[Connection] = []
+pending_waits: list[PendingWait] = []
+# Keys seen expired on read; reads never delete, they enqueue here and the
+# event loop drains the queue in shard-grouped batches.
+evict_queue: deque = deque()
+EVICT_BATCH = 128
+EVICT_INTERVAL_MS = 100
+
+
+def get_shard(key: bytes) -> Shard:
+    return shards[hash(key) & (SHARDS - 1)]
+
+
+def drain_evict_queue(timestamp: int) -> None:
+    keys_by_shard: dict[int, list[bytes]] = {}
+    for _ in range(min(len(evict_queue), EVICT_BATCH)):
+        key = evict_queue.popleft()
+        keys_by_shard.setdefault(hash(key) & (SHARDS - 1), []).append(key)
+
+    for shard_index, keys in keys_by_shard.items():
+        shard = shards[shard_index]
+        with shard.lock:
+            for key in keys:
+                expiry_ms = shard.expiries.get(key)
+                # The key may have been overwritten since it was enqueued, so
+                # only evict entries that are still expired
+                if expiry_ms is not None and timestamp >= expiry_ms:
+                    del shard.expiries[key]
+                    shard.values.pop(key, None)
+                    shard.encoded.pop(key, None)
+
+
+def enqueue(conn: Connection, data, flush: bool = True) -> None:
+    """
+    Queue a response on the connection and try to flush it right away.
+    Callers processing a pipelined batch pass flush=False and issue one
+    flush after the whole batch, so the replies leave in a single sendmsg.
+    """
+    if data is None:
+        return
+    parts = data if isinstance(data, list) else [data]
+    for part in parts:
+        conn.write_queue.append(
+            part if isinstance(part, bytes) else part.encode("utf-8")
+        )
+    if flush:
+        flush_write_queue(conn)
 
 
-def handle_ping():
-    return encode_resp("PONG")
+# sendmsg gathers every queued part in one syscall (Linux/BSD); fall back to
+# per-part send elsewhere. The kernel rejects gathers above IOV_MAX buffers
+# (EMSGSIZE), so deep pipelines are drained IOV_MAX parts at a time.
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+_IOV_MAX = 1024  # POSIX minimum and the Linux value
 
 
-def handle_echo(data_decoded):
-    return encode_resp(data_decoded[1])
+def flush_write_queue(conn: Connection) -> None:
+    while conn.write_queue:
+        try:
+            if _HAS_SENDMSG and len(conn.write_queue) > 1:
+                sent = conn.socket.sendmsg(
+                    list(itertools.islice(conn.write_queue, _IOV_MAX))
+                )
+            else:
+                sent = conn.socket.send(conn.write_queue[0])
+        except BlockingIOError:
+            break
+        except OSError as e:
+            # The peer went away between select() and this flush; tear the
+            # connection down instead of letting the error reach the loop
+            log.debug("Flush failed for %s: %s", conn.address, e)
+            close_connection(conn)
+            return
+        # Drop fully-sent parts and trim the partially-sent one, if any
+        while sent and conn.write_queue:
+            head = conn.write_queue[0]
+            if sent >= len(head):
+                sent -= len(head)
+                conn.write_queue.popleft()
+            else:
+                conn.write_queue[0] = head[sent:]
+                break
+    update_interest(conn)
 
 
-def handle_set(
-    data_decoded,
-    client_socket,
-    client_address,
-    replica_sockets,
-    database_lock,
-    database,
-    replication_info,
-    timestamp,
-    data,
-):
-    with database_lock:
-        for replica_socket in replica_sockets:
-            replicate([data], replica_socket)
+def update_interest(conn: Connection) -> None:
+    events = selectors.EVENT_READ
+    if conn.write_queue:
+        events |= selectors.EVENT_WRITE
+    selector.modify(conn.socket, events, conn)
 
-        key = data_decoded[1]
-        value = data_decoded[2]
-        expiry_timestamp = MAX_32BIT_TIMESTAMP
 
-        if len(data_decoded) == 5 and "px" == data_decoded[3]:
-            expiry_timestamp = int(data_decoded[4]) + timestamp
+def close_connection(conn: Connection) -> None:
+    if conn.closed:
+        return
+    conn.closed = True
+    log.debug("Connection closed: %s", conn.address)
+    try:
+        selector.unregister(conn.socket)
+    except KeyError:
+        pass
+    if conn in replica_connections:
+        replica_connections.remove(conn)
+    pending_waits[:] = [wait for wait in pending_waits if wait.connection is not conn]
+    conn.write_queue.clear()
+    conn.socket.close()
+    release_read_buffer(conn.read_buffer)
+
+
+def propagate_to_replicas(payload: bytes) -> None:
+    replication_info.master_repl_offset += len(payload)
+    for replica in replica_connections:
+        replica.expected_offset += len(payload)
+        # The same payload object is queued for every replica; flushing waits
+        # for the end of the tick so a pipelined batch of writes goes out in
+        # one gathered send per replica
+        replica.write_queue.append(payload)
+
+
+def count_acked_replicas(target_offset: int) -> int:
+    return sum(
+        1 if replica.last_offset >= target_offset else 0
+        for replica in replica_connections
+    )
 
-        database[key] = ValueItem(value, expiry_timestamp)
 
-        return encode_resp("OK")
+# Every command handler shares one signature so dispatch stays a plain dict
+# lookup: (conn, data_decoded, raw_command, timestamp); shared server state
+# (shards, replicas, replication_info) lives at module level.
+def handle_ping(conn, data_decoded, raw_command, timestamp):
+    return PONG_REPLY
 
 
-def handle_get(data_decoded, database_lock, database, timestamp):
-    with database_lock:
-        key = data_decoded[1]
-        value_item = database.get(key, not_found)
-        if (
-            value_item.expiry_timestamp is not None
-            and timestamp >= value_item.expiry_timestamp
-        ):
-            value_item = not_found
-            del database[key]
+def handle_echo(conn, data_decoded, raw_command, timestamp):
+    return encode_bulk(data_decoded[1])
 
-        return encode_resp(value_item.value)
 
+def handle_set(
+    conn, data_decoded, raw_command, timestamp, propagate=True
+):
+    if propagate:
+        # The hiredis path has no raw byte slice, so re-encode the command;
+        # client commands are arrays of bulk strings, which round-trip exactly.
+        payload = raw_command if raw_command is not None else encode_resp(data_decoded)
+        propagate_to_replicas(payload)
+
+    key = data_decoded[1]
+    value = data_decoded[2]
+    expiry_ms = None
+    if len(data_decoded) == 5 and b"px" == data_decoded[3].lower():
+        expiry_ms = int(data_decoded[4]) + timestamp
+
+    shard = get_shard(key)
+    with shard.lock:
+        shard.values[key] = value
+        shard.encoded.pop(key, None)
+        if expiry_ms is not None:
+            shard.expiries[key] = expiry_ms
+        else:
+            # Overwrites clear any TTL left from a previous SET ... PX
+            shard.expiries.pop(key, None)
+
+    return OK_REPLY
+
+
+def handle_get(conn, data_decoded, raw_command, timestamp):
+    key = data_decoded[1]
+    shard = get_shard(key)
+    with shard.lock:
+        value = shard.values.get(key)
+        if value is None:
+            return NULL_REPLY
+        expiry_ms = shard.expiries.get(key)
+        if expiry_ms is not None and timestamp >= expiry_ms:
+            # Deletion is deferred to drain_evict_queue so expired reads stay
+            # reads instead of turning into writes
+            evict_queue.append(key)
+            return NULL_REPLY
+        reply = shard.encoded.get(key)
+        if reply is None:
+            reply = shard.encoded[key] = encode_bulk(value)
+
+    return reply
+
+
+# Encoded INFO reply cached against the fields it is built from; replication
+# info changes rarely so most INFO calls return the same bytes object.
+_info_cache_key = None
+_info_cache_reply = b""
+
+
+def handle_info(conn, data_decoded, raw_command, timestamp):
+    global _info_cache_key, _info_cache_reply
+    cache_key = (
+        replication_info.role,
+        replication_info.master_replid,
+        replication_info.master_repl_offset,
+    )
+    if cache_key != _info_cache_key:
+        _info_cache_key = cache_key
+        _info_cache_reply = encode_bulk(
+            "\n".join(serialize_dataclass(replication_info)).encode("utf-8")
+        )
+    return _info_cache_reply
 
-def handle_info(replication_info):
-    return encode_resp("\n".join(serialize_dataclass(replication_info)))
 
+def handle_replconf(conn: Connection, data_decoded, raw_command, timestamp):
+    if len(data_decoded) == 3 and b"ack" == data_decoded[1].lower():
+        offset_received: int = int(data_decoded[2])
+        conn.last_offset = offset_received
+        log.debug(
+            "New last offset received (%d) for replica %s",
+            offset_received,
+            conn.address,
+        )
+        return None
 
-def handle_replconf(
-    data_decoded: list, replica_sockets: list[Replica], client_socket: socket.socket
-):
-    with replica_sockets_lock:
-        if len(data_decoded) == 3 and "ack" == data_decoded[1].lower():
-            offset_received: int = int(data_decoded[2])
-
-            replica_clients = [
-                replica
-                for replica in replica_sockets
-                if replica.socket == client_socket
-            ]
-            if len(replica_sockets) != 1:
-                raise Exception("Replica not found")
-            replica_client = replica_clients[0]
-            replica_client.last_offset = offset_received
-            print(
-                f"New last offset received ({offset_received}) for replica {replica_client}"
-            )
-            return None
+    return OK_REPLY
 
-    return encode_resp("OK")
 
+def handle_wait(conn: Connection, data_decoded, raw_command, timestamp):
+    min_replicas: int = int(data_decoded[1])
+    wait_time: int = int(data_decoded[2])
+    target_offset: int = replication_info.master_repl_offset
 
-def handle_wait(
-    data_encoded: list[object], replica_sockets: list[Replica], start_timestamp: int
-) -> str:
-    with replica_sockets_lock:
-        min_replicas_ack: int = int(data_encoded[1])
-        wait_time: int = int(data_encoded[2])
-        end: int = start_timestamp + wait_time
-        ack_replicas: int = sum(
-            1 if replica.last_offset == replica.expected_offset else 0
-            for replica in replica_sockets
-        )
+    if target_offset == 0:
+        # Nothing has been propagated yet, every replica is trivially in sync
+        return encode_resp(len(replica_connections))
 
-        if unix_timestamp() >= end or ack_replicas >= min_replicas_ack:
-            return encode_resp(ack_replicas)
+    ack_replicas = count_acked_replicas(target_offset)
+    if ack_replicas >= min_replicas:
+        return encode_resp(ack_replicas)
 
-        command: str = encode_resp(["REPLCONF", "GETACK", "*"]).encode("utf-8")
-        for replica in replica_sockets:
-            replica.send()
+    getack = encode_resp(["REPLCONF", "GETACK", "*"])
+    # Snapshot: a failed flush inside enqueue drops the replica from the list
+    for replica in list(replica_connections):
+        replica.expected_offset += len(getack)
+        enqueue(replica, getack)
+    replication_info.master_repl_offset += len(getack)
 
-        print(f"Replicas connected: {replica_sockets}")
-        return handle_wait(data_encoded, replica_sockets, start_timestamp)
+    pending_waits.append(
+        PendingWait(conn, min_replicas, timestamp + wait_time, target_offset)
+    )
+    return None  # reply is sent from check_pending_waits
+
+
+def check_pending_waits(timestamp: int) -> None:
+    still_pending = []
+    for wait in list(pending_waits):
+        if wait.connection.closed:
+            continue
+        ack_replicas = count_acked_replicas(wait.target_offset)
+        if ack_replicas >= wait.min_replicas or timestamp >= wait.deadline:
+            enqueue(wait.connection, encode_resp(ack_replicas))
+        else:
+            still_pending.append(wait)
+    # A flush above may have closed a waiter; keep only waits on live sockets
+    pending_waits[:] = [
+        wait for wait in still_pending if not wait.connection.closed
+    ]
 
 
-def handle_psync(data_decoded, client_address, client_socket, replica_sockets):
+def handle_psync(conn: Connection, data_decoded, raw_command, timestamp):
     replication_id = data_decoded[1]
-    if replication_id == "?":
+    if replication_id == b"?":
         new_replication_id = random_str(n=40)
-        response = f"FULLRESYNC {new_replication_id} 0"
+        response = f"FULLRESYNC {new_replication_id} 0".encode("utf-8")
         rdb_bytes = bytes.fromhex(EMPTY_RDB)
-        replica_sockets.append(Replica(socket=client_socket))
+        conn.is_replica = True
+        replica_connections.append(conn)
+        # Three fragments; the write queue hands them to sendmsg as-is, so the
+        # RDB payload is never copied into a joined buffer
         return [
-            encode_resp(response),
-            f"${len(rdb_bytes)}\r\n".encode("utf-8") + rdb_bytes,
+            encode_simple(response),
+            b"$%d\r\n" % len(rdb_bytes),
+            rdb_bytes,
         ]
 
     return None
 
 
-def handle_client(
-    client_socket: socket.socket,
-    client_address: str,
-    replication_info: ReplicationInfo,
-    send_response_back: bool = True,
-    buffer_size: int = 1024,
-):
-    print(f"New connection: {client_address}")
-    keep_client_socket_open = False
-
-    while True:
-        try:
-            request = client_socket.recv(buffer_size)
-            if not request:
-                print(f"Connection closed by client: {client_address}")
-                break
+COMMANDS = {
+    b"ping": handle_ping,
+    b"echo": handle_echo,
+    b"set": handle_set,
+    b"get": handle_get,
+    b"info": handle_info,
+    b"wait": handle_wait,
+    b"replconf": handle_replconf,
+    b"psync": handle_psync,
+}
+# Register the all-caps spellings too, so the common all-lower/all-upper
+# tokens dispatch without allocating a case-folded copy first
+COMMANDS.update({command.upper(): handler for command, handler in COMMANDS.items()})
 
-            timestamp = unix_timestamp()
-            data = request.decode()
-            data_decoded, _ = decode_resp(data)
-            command = data_decoded[0].lower()
-            print(f"Received from {client_address}: {data_decoded} at {timestamp}")
-            log_data: str = data.replace("\r\n", "\\r\\n")
-            print(f"Raw data: {log_data}")
-
-            if command == "ping":
-                response = handle_ping()
-            elif command == "echo":
-                response = handle_echo(data_decoded)
-            elif command == "set":
-                response = handle_set(
-                    data_decoded,
-                    client_socket,
-                    client_address,
-                    replica_sockets,
-                    database_lock,
-                    database,
-                    replication_info,
-                    timestamp,
-                    data,
-                )
-            elif command == "get":
-                response = handle_get(data_decoded, database_lock, database, timestamp)
-            elif command == "info":
-                response = handle_info(replication_info)
-            elif command == "wait":
-                response = handle_wait(data_decoded, replica_sockets, timestamp)
-            elif command == "replconf":
-                response = handle_replconf(data_decoded, replica_sockets, client_socket)
-            elif command == "psync":
-                response = handle_psync(
-                    data_decoded, client_address, client_socket, replica_sockets
-                )
-                keep_client_socket_open = True
 
-            if not send_response_back:
-                continue
-            if response:
-                if isinstance(response, list):
-                    for part in response:
-                        client_socket.send(
-                            part if isinstance(part, bytes) else part.encode("utf-8")
-                        )
-                else:
-                    client_socket.send(response.encode("utf-8"))
+def process_command(
+    conn: Connection,
+    data_decoded,
+    raw_command: bytes,
+    timestamp: int,
+):
+    command = data_decoded[0]
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Received from %s: %s at %d", conn.address, data_decoded, timestamp)
 
-        except Exception as e:
-            print(f"Error with {client_address}: {e}")
-            break
+    # Exact-case hit first; only mixed-case tokens pay for a folded copy
+    handler = COMMANDS.get(command) or COMMANDS.get(command.lower())
+    if handler is None:
+        enqueue(conn, NULL_REPLY, flush=False)
+        return
 
-    if not keep_client_socket_open:
-        client_socket.close()
+    response = handler(conn, data_decoded, raw_command, timestamp)
+    enqueue(conn, response, flush=False)
 
 
-def handle_master_conn(
-    master_socket: socket.socket,
-) -> None:
+def receive_into_buffer(conn: Connection) -> int:
     """
-    Assumess message is RESP encoded. 1-2 messages are expected after
+    Reads whatever the socket offers into the connection's persistent buffer.
+    Returns the byte count received; 0 means the peer closed the connection.
     """
-    # Continue listening for messages from master
-    processed_bytes_count: int = 0
-    while True:
-        try:
-            incoming_message = master_socket.recv(1024)
+    if conn.tail == len(conn.read_buffer):  # oversize frame, grow the buffer
+        conn.read_buffer.extend(bytes(RECV_BUFFER_SIZE))
+    view = memoryview(conn.read_buffer)
+    received = conn.socket.recv_into(view[conn.tail :])
+    conn.tail += received
+    return received
 
-            if not incoming_message:
-                print("Connection closed by master...")
-                break
 
-            timestamp = unix_timestamp()
-            data = incoming_message.decode(errors="ignore")
-
-            log_data: str = data.replace("\r\n", "\\r\\n")
-            print(f"Raw data: {log_data}")
-            commands = decode_multiple_resp_commands(data)
-            pprint(f"Received from master replication commands: {commands}")
-
-            for command, bytes_size in commands:
-                if command[0].lower() == "set":
-                    handle_set(
-                        command,
-                        None,
-                        None,
-                        replica_sockets,
-                        database_lock,
-                        database,
-                        None,
-                        timestamp,
-                        data,
-                    )
-                elif command[0].lower() == "replconf":
-                    response: list = encode_resp(
-                        [
-                            "REPLCONF",
-                            "ACK",
-                            str(processed_bytes_count),
-                        ]
-                    )
-                    master_socket.send(response.encode("utf-8"))
-                processed_bytes_count += bytes_size
-        except Exception as e:
-            print(f"Error with master connection...")
-            break
+def discard_parsed_bytes(conn: Connection, consumed: int) -> None:
+    """Shifts unparsed bytes to the front of the buffer for the next recv."""
+    if consumed == 0:
+        return
+    remaining = conn.tail - consumed
+    if remaining:
+        conn.read_buffer[:remaining] = conn.read_buffer[consumed : conn.tail]
+    conn.tail = remaining
 
-    master_socket.close()
+
+def handle_readable(conn: Connection, timestamp: int) -> None:
+    try:
+        received = receive_into_buffer(conn)
+    except BlockingIOError:
+        return
+    except ConnectionError:
+        close_connection(conn)
+        return
+
+    if not received:
+        close_connection(conn)
+        return
+
+    if log.isEnabledFor(logging.DEBUG):
+        raw_chunk = conn.read_buffer[conn.tail - received : conn.tail]
+        log.debug("Raw data: %s", raw_chunk.decode(errors="ignore").replace("\r\n", "\\r\\n"))
+
+    if conn.resp_reader is not None:
+        # hiredis buffers internally: hand it everything we have and drain it
+        conn.resp_reader.feed(memoryview(conn.read_buffer)[: conn.tail])
+        conn.tail = 0
+        while True:
+            try:
+                data_decoded = conn.resp_reader.gets()
+            except hiredis.ProtocolError as e:
+                log.warning("Error with %s: %s", conn.address, e)
+                close_connection(conn)
+                return
+            if data_decoded is False:
+                break
+            try:
+                process_command(conn, data_decoded, None, timestamp)
+            except Exception as e:
+                log.warning("Error with %s: %s", conn.address, e)
+                close_connection(conn)
+                return
+        if conn.write_queue:
+            flush_write_queue(conn)
+        return
+
+    commands = decode_multiple_resp_commands(conn.read_buffer, conn.tail)
+    consumed = 0
+    for data_decoded, byte_size in commands:
+        raw_command = bytes(conn.read_buffer[consumed : consumed + byte_size])
+        consumed += byte_size
+        try:
+            process_command(conn, data_decoded, raw_command, timestamp)
+        except Exception as e:
+            log.warning("Error with %s: %s", conn.address, e)
+            close_connection(conn)
+            return
+    discard_parsed_bytes(conn, consumed)
+    if conn.write_queue:
+        flush_write_queue(conn)
 
 
-def replicate(messages: list[str], replica: Replica) -> None:
+def handle_master_readable(conn: Connection, timestamp: int) -> None:
     """
-    Assumess message is RESP encoded
+    Processes commands propagated by the master over the replication link.
     """
-    for message in messages:
-        pprint(f"Replicating {message} to {replica}")
-        replica.send(message.encode("utf-8"))
+    try:
+        received = receive_into_buffer(conn)
+    except BlockingIOError:
+        return
+    except ConnectionError:
+        close_connection(conn)
+        return
+
+    if not received:
+        log.debug("Connection closed by master...")
+        close_connection(conn)
+        return
+
+    commands = decode_multiple_resp_commands(conn.read_buffer, conn.tail)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Received from master replication commands: %s", commands)
+
+    consumed = 0
+    for command, bytes_size in commands:
+        if command[0].lower() == b"set":
+            handle_set(conn, command, None, timestamp, propagate=False)
+        elif command[0].lower() == b"replconf":
+            response = encode_resp(
+                [
+                    "REPLCONF",
+                    "ACK",
+                    str(conn.processed_offset),
+                ]
+            )
+            enqueue(conn, response, flush=False)
+        conn.processed_offset += bytes_size
+        consumed += bytes_size
+    discard_parsed_bytes(conn, consumed)
+    if conn.write_queue:
+        flush_write_queue(conn)
+
+
+SOCKET_BUFFER_SIZE = 262144
+
+
+def tune_socket(sock: socket.socket) -> None:
+    """Latency/throughput options applied to every data socket."""
+    # Small request/response frames must not sit in Nagle's coalescing window
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if hasattr(socket, "TCP_QUICKACK"):  # Linux only
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+
+
+def accept_connection(server_socket: socket.socket) -> None:
+    client_socket, client_address = server_socket.accept()
+    client_socket.setblocking(False)
+    tune_socket(client_socket)
+    conn = Connection(socket=client_socket, address=client_address)
+    if hiredis is not None:
+        conn.resp_reader = hiredis.Reader()
+    selector.register(client_socket, selectors.EVENT_READ, conn)
+    log.debug("New connection: %s", client_address)
+
+
+def run_event_loop(
+    server_socket: socket.socket,
+    master_socket: socket.socket = None,
+    master_info: tuple = None,
+) -> None:
+    server_socket.setblocking(False)
+    selector.register(server_socket, selectors.EVENT_READ, None)
+
+    if master_socket is not None:
+        master_socket.setblocking(False)
+        tune_socket(master_socket)
+        master_conn = Connection(
+            socket=master_socket, address=master_info, is_master_link=True
+        )
+        selector.register(master_socket, selectors.EVENT_READ, master_conn)
+
+    last_evict_ms = monotonic_ms()
+    while True:
+        events = selector.select(timeout=0.1)
+        # One coarse clock sample serves every event in this tick; expiry and
+        # WAIT deadlines are stored relative to the same monotonic clock.
+        timestamp = monotonic_ms()
+        for key, mask in events:
+            if key.data is None:
+                accept_connection(server_socket)
+                continue
+
+            conn = key.data
+            try:
+                if mask & selectors.EVENT_WRITE:
+                    flush_write_queue(conn)
+                if mask & selectors.EVENT_READ:
+                    if conn.is_master_link:
+                        handle_master_readable(conn, timestamp)
+                    else:
+                        handle_readable(conn, timestamp)
+            except Exception as e:
+                log.warning("Error with %s: %s", conn.address, e)
+                close_connection(conn)
+
+        # Snapshot: a failed flush closes the replica and removes it mid-loop
+        for replica in list(replica_connections):
+            if replica.write_queue:
+                flush_write_queue(replica)
+        check_pending_waits(timestamp)
+        if timestamp - last_evict_ms >= EVICT_INTERVAL_MS:
+            drain_evict_queue(timestamp)
+            last_evict_ms = timestamp
 
 
 def start_redis_server():
+    global selector
+
     parser = argparse.ArgumentParser(description="Example script.")
     parser.add_argument(
         "--port", help="Redis server port, defaults to 6379", default=6379, type=int
@@ -400,9 +863,15 @@ def start_redis_server():
         default=None,
         type=str,
     )
+    parser.add_argument(
+        "--workers",
+        help="Accept-loop worker processes sharing the port, defaults to 1",
+        default=1,
+        type=int,
+    )
     args = parser.parse_args()
     master_info: tuple[str, int] = None
-    master_thread: threading.Thread = None
+    master_socket: socket.socket = None
 
     role: str = MASTER_REPLICATION
     if args.replicaof is not None:
@@ -422,56 +891,45 @@ def start_redis_server():
 
         print(f"Pinging master over: {master_info}")
 
-        master_socket.sendall(encode_resp(["PING"]).encode())
+        master_socket.sendall(encode_resp(["PING"]))
         assert master_socket.recv(128).decode().strip() == "+PONG"
 
         master_socket.sendall(
-            encode_resp(["REPLCONF", "listening-port", str(args.port)]).encode()
+            encode_resp(["REPLCONF", "listening-port", str(args.port)])
         )
         assert master_socket.recv(1024).decode().strip() == "+OK"
 
-        master_socket.sendall(encode_resp(["REPLCONF", "capa", "psync2"]).encode())
+        master_socket.sendall(encode_resp(["REPLCONF", "capa", "psync2"]))
         assert master_socket.recv(1024).decode().strip() == "+OK"
 
-        master_socket.sendall(encode_resp(["PSYNC", "?", "-1"]).encode())
+        master_socket.sendall(encode_resp(["PSYNC", "?", "-1"]))
         psync_msg = master_socket.recv(56).decode()
         rdb_msg = master_socket.recv(2048)
 
-        master_thread = threading.Thread(
-            target=handle_master_conn,
-            args=(master_socket,),
-        ).start()
-
-        # print("Waiting a bit to accept new client connections...")
-        # time.sleep(1.5)
+    worker_count: int = max(1, args.workers if args.workers else os.cpu_count())
+    if role == MASTER_REPLICATION and worker_count > 1:
+        # Each worker opens its own listening socket on the shared port; the
+        # kernel's reuseport hash spreads incoming SYNs across their accept
+        # queues. The keyspace and replica bookkeeping are per-process, so
+        # replication setups should stay at the default of one worker.
+        for _ in range(worker_count - 1):
+            if os.fork() == 0:  # child: run its own accept loop
+                # The epoll fd predates the fork; a fresh selector keeps this
+                # worker's registrations out of its siblings' event sets
+                selector = selectors.DefaultSelector()
+                break
 
     server_socket = socket.create_server(("localhost", args.port), reuse_port=True)
     server_socket.listen()
-    threads = []
+    replication_info.role = role
+    warm_up_parser()
 
     print(f"Server is listening for connections on port {args.port}...")
     try:
-        while True:
-            client_socket, client_address = server_socket.accept()  # wait for client
-            client_thread = threading.Thread(
-                target=handle_client,
-                args=(
-                    client_socket,
-                    client_address,
-                    ReplicationInfo(role=role),
-                    True,
-                    1024,
-                ),
-            )
-            client_thread.daemon = True  # daemon threads are killed automatically when the main program exits
-            client_thread.start()
-            threads.append(client_thread)
+        run_event_loop(server_socket, master_socket, master_info)
     finally:
+        selector.close()
         server_socket.close()
-        for thread in threads:
-            thread.join()  # Wait for all client threads to finish
-        if master_thread is not None:
-            master_thread.join()
         print("Server has been gracefully shutdown.")
 
 